@@ -28,7 +28,7 @@ def getFillRuns(omsapi, fillNumber):
     q.custom("fields", "physics_flag,beam1_stable,beam2_stable,run_number")
     q.per_page = PAGE_LIMIT
     data = q.data().json()['data']
-    return list({item['attributes']['run_number'] for item in data if item['attributes']['physics_flag'] and item['attributes']['beam1_stable'] and item['attributes']['beam2_stable']})
+    return sorted({item['attributes']['run_number'] for item in data if item['attributes']['physics_flag'] and item['attributes']['beam1_stable'] and item['attributes']['beam2_stable']})
 
 # Function to get min/max lumisections for a run
 def getMinMaxLS(omsapi, run):
@@ -82,16 +82,20 @@ def getHLTRate(omsapi, run, minLS, maxLS):
     )
     return {row['attributes']['last_lumisection_number']: row['attributes']['counter'] / LS_LENGTH for row in data}
 
-# Function to get detailed lumisection data
+# Function to get detailed lumisection data, with the prescale column and
+# stable-beam/physics flags split off so they stay out of the stream entries
 def getLumisectionDetails(omsapi, run, minLS, maxLS):
     data = getOMSdata(omsapi, "lumisections",
-                      attributes=['delivered_lumi_per_lumisection', 'run_number', 'lumisection_number', 'start_time', 'pileup'],
+                      attributes=['delivered_lumi_per_lumisection', 'run_number', 'lumisection_number', 'start_time', 'pileup',
+                                  'prescale_index', 'physics_flag', 'beam1_stable', 'beam2_stable'],
                       filters={"run_number": [run], "lumisection_number": [minLS, maxLS]},
                       max_pages=5000)
     
     lumisection_details = {}
+    ls_flags = {}
     for row in data:
         ls_number = row['attributes']['lumisection_number']
+        ls_flags[ls_number] = {key: row['attributes'].pop(key, None) for key in ['prescale_index', 'physics_flag', 'beam1_stable', 'beam2_stable']}
         lumisection_details[ls_number] = row['attributes']
 
         # Convert start time to Unix timestamp
@@ -101,7 +105,67 @@ def getLumisectionDetails(omsapi, run, minLS, maxLS):
         HH, MM, SS = map(int, time[:-1].split(':'))
         lumisection_details[ls_number]['time'] = int(datetime(yy, mm, dd, HH, MM, SS).timestamp())
 
-    return lumisection_details
+    return lumisection_details, ls_flags
+
+# Function to build the LS index of a (possibly multi-run) fill.
+# LS numbers are shifted by a per-run offset equal to the last LS with stream
+# records of the previous runs, as the plotter does when merging all stream LSs.
+def buildLSIndex(run_flags, run_last_ls):
+    ls_index = {'runs': {}, 'prescale_LS': [], 'prescale_segments': [], 'transition_LS': [], 'bad_LS': []}
+    ls_offset = 0
+    segment = None
+
+    for run in run_flags:
+        last_ls = run_last_ls[run]
+        if last_ls is None:
+            print(f"Warning: no stream data for run {run}, leaving it out of the LS index")
+            continue
+        ls_index['runs'][str(run)] = {'ls_offset': ls_offset, 'last_LS': last_ls}
+
+        # transitions only happen inside a run, a new run starts cleanly on its column
+        prescale_index = None
+
+        for ls in sorted(run_flags[run]):
+            if ls > last_ls:
+                break
+            attr = run_flags[run][ls]
+            merged_ls = ls + ls_offset
+            good = bool(attr.get('physics_flag') and attr.get('beam1_stable') and attr.get('beam2_stable'))
+
+            if prescale_index is not None and attr.get('prescale_index') != prescale_index:
+                # the LS where the column switches mixes two prescale sets,
+                # the new segment starts at the next LS
+                ls_index['transition_LS'].append(merged_ls)
+                segment = None
+            else:
+                # the previous run ended on another column
+                if segment is not None and attr.get('prescale_index') != segment['prescale_index']:
+                    segment = None
+
+                # a segment opens at the first good LS of its column
+                if segment is None and good:
+                    segment = {'prescale_index': attr.get('prescale_index'), 'first_LS': merged_ls, 'last_LS': merged_ls, 'good_LS_ranges': []}
+                    ls_index['prescale_segments'].append(segment)
+                    ls_index['prescale_LS'].append(merged_ls)
+
+                if segment is not None:
+                    segment['last_LS'] = merged_ls
+
+                    # contiguous [first, last] ranges of good LSs inside the segment
+                    if good:
+                        ranges = segment['good_LS_ranges']
+                        if ranges and ranges[-1][1] == merged_ls - 1:
+                            ranges[-1][1] = merged_ls
+                        else:
+                            ranges.append([merged_ls, merged_ls])
+
+            if not good:
+                ls_index['bad_LS'].append(merged_ls)
+            prescale_index = attr.get('prescale_index')
+
+        ls_offset += last_ls
+
+    return ls_index
 
 # Function to get stream data
 def getStreamData(omsapi, run, lumisection_details, minLS, maxLS):
@@ -150,6 +214,8 @@ else:
     runs = [args.run]
 
 all_stream_data = {}
+run_flags = {}
+run_last_ls = {}
 
 for run in runs:
     print(f"Processing run: {run}")
@@ -158,7 +224,7 @@ for run in runs:
     minLS, maxLS = getMinMaxLS(omsapi, run)
 
     # Fetch lumisection details
-    lumisection_details = getLumisectionDetails(omsapi, run, minLS, maxLS)
+    lumisection_details, ls_flags = getLumisectionDetails(omsapi, run, minLS, maxLS)
 
     # Fetch deadtime data
     deadtime_data = getDeadtime(omsapi, run, minLS, maxLS)
@@ -172,6 +238,13 @@ for run in runs:
     # Store results
     all_stream_data[run] = stream_data
 
+    # Keep prescale column/flags and the last LS with stream records for the LS index
+    run_flags[run] = ls_flags
+    run_last_ls[run] = max((e['LS'] for entries in stream_data.values() for e in entries), default=None)
+
+# Precomputed prescale segments, bad/transition LSs and per-run LS offsets
+all_stream_data['ls_index'] = buildLSIndex(run_flags, run_last_ls)
+
 # Save to JSON file
 with open(args.output, 'w') as json_file:
     json.dump(all_stream_data, json_file, indent=4)